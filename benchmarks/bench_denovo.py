@@ -0,0 +1,199 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# run from anywhere: the benchmarks live one level below denovo.py
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import denovo
+
+def timeit(func, repeats):
+    """Run func repeatedly and report the median wall time in seconds"""
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+# STRling outlier columns for the tiny short-job input
+OUTLIER_COLUMNS = ['chrom', 'left', 'right', 'repeatunit', 'allele1_est',
+                    'allele2_est', 'spanning_reads', 'spanning_pairs',
+                    'left_clips', 'right_clips', 'unplaced_pairs',
+                    'sum_str_counts', 'sum_str_log', 'depth', 'outlier', 'p',
+                    'p_adj', 'sample', 'locus']
+
+def write_tiny_outliers(filename, samples, nloci = 5):
+    """A few outlier rows per sample, enough for a job to run end to end"""
+
+    with open(filename, 'w') as outfile:
+        outfile.write('\t'.join(OUTLIER_COLUMNS) + '\n')
+        for sample in samples:
+            for i in range(nloci):
+                outfile.write('\t'.join(str(x) for x in ['chr1', 100 * i,
+                    100 * i + 50, 'CAG', 10 + i, 20 + i, 1, 1, 0, 0, 0, 10, 2.3,
+                    20, 1.5, 0.1, 0.2, sample, 'chr1-%d-CAG' % (100 * i)]) + '\n')
+
+def bench_startup(script = os.path.join(REPO, 'strling-denovo.py'),
+                    repeats = 10):
+    """Wall time of a short job: strling-denovo.py run on Trio.ped with a tiny
+    outliers file, so it is almost all interpreter startup, imports and ped
+    parsing, which every shard or family batch pays."""
+
+    pedfile = os.path.join(REPO, 'Trio.ped')
+    samples = list(denovo.read_trios(pedfile)[0][:3])
+    with tempfile.TemporaryDirectory() as tmp:
+        outliers = os.path.join(tmp, 'outliers.tsv')
+        write_tiny_outliers(outliers, samples)
+        command = [sys.executable, script, '--outliers', outliers,
+                    '--ped', pedfile, '--out', os.path.join(tmp, 'out.tsv')]
+        return timeit(lambda: subprocess.run(command, check = True,
+                        stdout = subprocess.DEVNULL,
+                        stderr = subprocess.DEVNULL), repeats)
+
+def bench_ped(repeats = 200):
+    """Resolving the trios in Trio.ped with the built-in ped reader"""
+
+    pedfile = os.path.join(REPO, 'Trio.ped')
+    return timeit(lambda: denovo.read_trios(pedfile), repeats)
+
+def load_baseline(rev, tmp):
+    """Check out denovo.py and strling-denovo.py from a git revision into tmp
+    and import that denovo, so the same benchmarks can be run against it.
+
+    Returns:
+        module, script: the baseline denovo module and its strling-denovo.py"""
+
+    for filename in ('denovo.py', 'strling-denovo.py'):
+        source = subprocess.run(['git', 'show', '%s:%s' % (rev, filename)],
+                    cwd = REPO, check = True, stdout = subprocess.PIPE).stdout
+        with open(os.path.join(tmp, filename), 'wb') as outfile:
+            outfile.write(source)
+    spec = importlib.util.spec_from_file_location('denovo_baseline',
+                                            os.path.join(tmp, 'denovo.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module, os.path.join(tmp, 'strling-denovo.py')
+
+def classification_args(module, flags, out = 'x'):
+    """Parsed arguments for module, as Params where it has get_params"""
+
+    args = module.get_args(['--outliers', 'x', '--ped', 'x', '--out', out]
+                            + flags)
+    if hasattr(module, 'get_params'):
+        return args, module.get_params(args)
+    return args, args
+
+def bench_classify(module, flags, nloci = 20000, repeats = 5):
+    """Per-locus classification: full_allele_check over random trio alleles
+    (some missing, some over the allele cutoff), reported per locus."""
+
+    args, params = classification_args(module, flags)
+    rng = random.Random(0)
+    choices = [lambda: math.nan, lambda: rng.uniform(0, 60),
+                lambda: rng.uniform(0, 500)]
+    loci = [[(rng.choice(choices)(), rng.choice(choices)()) for _ in range(3)]
+            for _ in range(nloci)]
+
+    def classify():
+        for mom, dad, kid in loci:
+            module.full_allele_check({'allele1': mom[0], 'allele2': mom[1]},
+                                    {'allele1': dad[0], 'allele2': dad[1]},
+                                    {'allele1': kid[0], 'allele2': kid[1]},
+                                    params)
+
+    return timeit(classify, repeats) / nloci
+
+def trio_outliers(nloci):
+    """Random outlier rows for a kid, mom and dad sharing nloci loci"""
+
+    pd = denovo.import_pandas()
+    rng = random.Random(0)
+    rows = []
+    for sample in ('kid', 'mom', 'dad'):
+        for i in range(nloci):
+            allele2 = rng.choice([math.nan, rng.uniform(5, 200)])
+            rows.append(['chr1', 100 * i, 100 * i + 50, 'CAG',
+                rng.uniform(5, 40), allele2, 1, 1, 0, 0, 0, 10, 2.3,
+                rng.randint(5, 40), 1.5, 0.1, 0.2, sample, 'chr1-%d-CAG' % i])
+
+    return pd.DataFrame(rows, columns = OUTLIER_COLUMNS)
+
+def bench_trio(module, flags, nloci = 1000, repeats = 3):
+    """Per-locus cost of a whole trio through strlingMV (selection, merges,
+    the classification loop and writing), reported per locus."""
+
+    df = trio_outliers(nloci)
+    with tempfile.TemporaryDirectory() as tmp:
+        args, params = classification_args(module, flags,
+                                            os.path.join(tmp, 'out.tsv'))
+        def trio():
+            with contextlib.redirect_stdout(io.StringIO()):
+                module.strlingMV(df, 'kid', 'mom', 'dad', '0', args)
+
+        return timeit(trio, repeats) / nloci
+
+def bench_classify_loci(module, flags, nloci = 1000, repeats = 3):
+    """Per-locus cost of classify_loci alone on a merged trio: the loop that
+    calls full_allele_check on every locus and adds the result columns"""
+
+    df = trio_outliers(nloci)
+    args, params = classification_args(module, flags)
+    dfkid, dfmom, dfdad = denovo.prepare_members(df, df.loc[df['sample'] == 'kid'],
+                df.loc[df['sample'] == 'mom'], df.loc[df['sample'] == 'dad'])
+    kiddadmom = dfkid.merge(dfdad, on = 'locus').merge(dfmom, on = 'locus')
+
+    return timeit(lambda: module.classify_loci(kiddadmom.copy(), params),
+                    repeats) / nloci
+
+def report(name, unit, scale, current, baseline = None):
+    """Print a benchmark, with the baseline and speedup when there is one"""
+
+    line = '%s: %.2f %s' % (name, current * scale, unit)
+    if baseline is not None:
+        line += ' (baseline %.2f %s, %.2fx)' % (baseline * scale, unit,
+                                                baseline / current)
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", default = None,
+        help = "git revision to run the same benchmarks against for comparison")
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = script = None
+        if options.baseline is not None:
+            baseline, script = load_baseline(options.baseline, tmp)
+
+        report('short job (Trio.ped, tiny outliers)', 'ms', 1e3,
+                bench_startup(), script and bench_startup(script))
+        report('read_trios(Trio.ped)', 'ms', 1e3, bench_ped())
+        for flags in ([], ['--includeDMV', 'Yes', '--includeallelediff', 'Yes']):
+            name = ' '.join(flags) or 'defaults'
+            report('full_allele_check %s' % name, 'us/locus', 1e6,
+                    bench_classify(denovo, flags),
+                    baseline and bench_classify(baseline, flags))
+            # classify_loci only exists in revisions from the --families work on
+            report('classify_loci %s' % name, 'us/locus', 1e6,
+                    bench_classify_loci(denovo, flags),
+                    baseline and hasattr(baseline, 'classify_loci') and
+                    bench_classify_loci(baseline, flags) or None)
+            report('strlingMV trio %s' % name, 'us/locus', 1e6,
+                    bench_trio(denovo, flags),
+                    baseline and bench_trio(baseline, flags))
+
+if __name__ == "__main__":
+	main()
@@ -1,9 +1,14 @@
-# these are the necessary modules for this code
-import pandas as pd
-pd.options.mode.chained_assignment = None  # default='warn'
-import numpy as np
-import peddy
+# these are the necessary modules for this code; pandas is heavy to import,
+# so it is only loaded once it is needed, by import_pandas
 import argparse
+import collections
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import time
 
 def get_args(args):
     """Incorporating argparse into the code for interchangeable arguments"""
@@ -40,24 +45,211 @@ def get_args(args):
     parser.add_argument("--includeallelediff", type = str, default = 'No',
         help = "whether to include columns for allele difference (default: %(default)s)")
 
+    parser.add_argument("--shard", type = str, default = None,
+        help = "run only shard I of N (written I/N, 1-based), with trios balanced by size")
+
+    parser.add_argument("--families", action = "store_true",
+        help = "run siblings with the same parents together, joining the parents once; output stays in ped order")
+
+    parser.add_argument("--progress", type = float, default = 60.0,
+        help = "seconds between progress reports, 0 to turn off (default: %(default)s)")
+
+    parser.add_argument("--metrics", type = str, default = None,
+        help = "append progress reports as JSON lines to this file instead of stderr")
+
+    parser.add_argument("--resume", action = "store_true",
+        help = "skip trios already recorded in the checkpoint manifest and append to --out")
+
     return parser.parse_args(args)
 
+# the classification parameters, validated and converted once by get_params
+# so the per-locus checks only read plain numbers and booleans: switchover is
+# the allele size below which minwig is larger than the proportional wiggle,
+# and low/high are the proportional range factors
+Params = collections.namedtuple('Params', ['wiggle', 'minwig', 'switchover',
+                    'low', 'high', 'depth', 'ampsize', 'allelecutoff',
+                    'includeDMV', 'includeallelediff'])
+
+def get_params(args):
+    """Build the immutable classification parameters from get_args output
+
+    Parameters:
+        args (Namespace): parsed command line arguments
+
+    Returns:
+        (Params): validated parameters for the allele checks"""
+
+    wiggle = float(args.wiggle)
+    minwig = float(args.minwig)
+    if (wiggle > 1.0) or (wiggle < 0.0):
+        raise ValueError('wiggle proportion must be a value between 0 and 1')
+    if args.includeDMV not in ('Yes', 'No'):
+        raise ValueError('IncludeDMV argument must be exact')
+
+    # allele * wiggle < minwig is the same as allele < minwig / wiggle
+    if wiggle > 0.0:
+        switchover = minwig / wiggle
+    else:
+        switchover = math.inf if minwig > 0.0 else -math.inf
+
+    return Params(wiggle = wiggle, minwig = minwig, switchover = switchover,
+                low = 1 - wiggle, high = 1 + wiggle, depth = float(args.depth),
+                ampsize = float(args.ampsize),
+                allelecutoff = float(args.allelecutoff),
+                includeDMV = args.includeDMV == 'Yes',
+                includeallelediff = args.includeallelediff == 'Yes')
+
 # we are now going to define a bunch of functions, hurray!
-def has_parents(sample):
-    """Here we perform a check to determine if Peddy sample has both
-    parents in ped file to form trio.
+def import_pandas():
+    """pandas is slow to import, so get_denovos only loads it once it is about
+    to read the outliers; this also turns off the chained assignment warning
+    for the per-member column assignments in strlingMV"""
+
+    import pandas as pd
+    pd.options.mode.chained_assignment = None  # default='warn'
+
+    return pd
+
+# a trio resolved from the ped file, along with the mutation (phenotype)
+# that get_denovos reports for it
+Trio = collections.namedtuple('Trio', ['kid', 'mom', 'dad', 'mutation'])
+
+# ped values that mean a parent is unknown
+PED_MISSING = ('-9', '0', '.')
+
+def split_ped_line(line):
+    """Split a ped line on tabs, or on runs of whitespace when the line has
+    more spaces than tabs (as in the first line of Trio.ped).
+
+    Parameters:
+        line (str): one line of a ped file, without the newline
+
+    Returns:
+        (list): the fields of the line"""
+
+    if line.count('\t') > line.count(' '):
+        return line.split('\t')
+    return re.split(r'\s+', line.strip())
+
+def trio_mutation(momphenotype, dadphenotype):
+    """Supply the mutation for a trio from mom and dad in the pedigree:
+    mom will override dad if both are non-zero.
+
+    Parameters:
+        momphenotype, dadphenotype (str): phenotype column of each parent
+
+    Returns:
+        (str): the parental phenotype to report, or '0' if neither has one"""
+
+    if momphenotype != '0':
+        return momphenotype
+    elif dadphenotype != '0':
+        return dadphenotype
+    return '0'
+
+def read_trios(pedfile):
+    """A lightweight reader for the 6-column ped format that finds every
+    sample with both parents listed. Samples come out family by family, in
+    the order families first appear, matching the trio order that peddy gave.
+    A parent that is listed for a kid but has no row of their own in the
+    family has an unknown phenotype of '-9'. Columns after the sixth are
+    ignored.
+
+    Parameters:
+        pedfile (str): path to the ped file
+
+    Returns:
+        (list): a Trio (kid, mom, dad, mutation) per kid with both parents"""
+
+    families = collections.OrderedDict()
+    with open(pedfile) as infile:
+        lines = [line.rstrip('\r\n') for line in infile if line.strip()]
+
+    for i, line in enumerate(lines):
+        fields = split_ped_line(line)
+        # an optional header is allowed on the first line only
+        if i == 0 and (fields[0].startswith('#') or
+                        fields[0].lower() in ('family_id', 'kindred_id')):
+            continue
+        family_id, sample_id, paternal_id, maternal_id = fields[:4]
+        families.setdefault(family_id, []).append(
+            (sample_id, paternal_id or '-9', maternal_id or '-9', fields[5]))
+
+    trios = []
+    for samples in families.values():
+        phenotypes = {sample[0]: sample[3] for sample in samples}
+        for sample_id, paternal_id, maternal_id, phenotype in samples:
+            if paternal_id in PED_MISSING or maternal_id in PED_MISSING:
+                continue
+            mutation = trio_mutation(phenotypes.get(maternal_id, '-9'),
+                                    phenotypes.get(paternal_id, '-9'))
+            trios.append(Trio(sample_id, maternal_id, paternal_id, mutation))
+
+    return trios
+
+def plan_trios(df, trios):
+    """The planning stage: before any per-trio work, intersect the trio
+    members with the samples in the outlier data once, and estimate how
+    much work each trio is from its members' row counts.
+
+    Parameters:
+        df (dataframe): dataframe of STRling outlier data
+        trios (list): Trio tuples from read_trios
+
+    Returns:
+        planned (list): (trio, work) for trios with all members present,
+        where work is the total outlier rows of kid, mom and dad
+        skipped (list): (trio, missing) for the other trios, where missing
+        lists the sample IDs without any outlier rows"""
+
+    rowcounts = df['sample'].value_counts().to_dict()
+    planned = []
+    skipped = []
+    for trio in trios:
+        members = (trio.kid, trio.mom, trio.dad)
+        missing = [member for member in members if member not in rowcounts]
+        if missing:
+            skipped.append((trio, missing))
+        else:
+            planned.append((trio, sum(rowcounts[member] for member in members)))
+
+    return planned, skipped
+
+def parse_shard(shard):
+    """Turn the --shard argument 'I/N' into a 0-based shard index and count"""
+
+    try:
+        index, count = (int(x) for x in shard.split('/'))
+    except ValueError:
+        raise ValueError('shard must be written I/N, for example 1/4')
+    if not 1 <= index <= count:
+        raise ValueError('shard index must be between 1 and the shard count')
+
+    return index - 1, count
+
+def shard_trios(planned, index, count):
+    """Split the planned trios across shards so each shard gets a similar
+    amount of work: the largest trios are placed first, each one on the
+    shard with the least work so far. Within a shard the trios keep their
+    ped order, so the output of a shard does not depend on trio sizes.
 
     Parameters:
-        sample (int): sample ID taken from ped file to determine trios
+        planned (list): (trio, work) from plan_trios
+        index (int): 0-based shard to return
+        count (int): total number of shards
 
     Returns:
-    (bool)
-            True if trio exists and both parents are present
-            False if trio does not exist"""
+        (list): the (trio, work) entries assigned to this shard"""
+
+    loads = [0] * count
+    assigned = [None] * len(planned)
+    largest_first = sorted(range(len(planned)), key = lambda i: -planned[i][1])
+    for i in largest_first:
+        target = loads.index(min(loads))
+        loads[target] += planned[i][1]
+        assigned[i] = target
 
-    if sample.mom is not None and sample.dad is not None:
-        return True
-    return False
+    return [entry for entry, shard in zip(planned, assigned) if shard == index]
 
 def closest(lst, allele):
     """"This returns the closest value from a list to an input value (allele)
@@ -87,7 +279,7 @@ def allele_diff(lst, allele):
 
     return allelediff
 
-def allele_check(allele1, allele2, args):
+def allele_check(allele1, allele2, params):
     """The allele check ensures that an allele pair taken from a member of the
     trio are functional for analysis: a NaN allele will take the other allele's
     value, and any allele that is greater than the allelecutoff will be set to
@@ -99,30 +291,30 @@ def allele_check(allele1, allele2, args):
 
     Returns: allele1, allele2 (float): standardized alleles"""
 
-    if (not np.isnan(allele1)) & np.isnan(allele2):
-        if (allele1 >= args.allelecutoff):
-            allele2 = args.allelecutoff
-            allele1 = args.allelecutoff
+    if (not math.isnan(allele1)) & math.isnan(allele2):
+        if (allele1 >= params.allelecutoff):
+            allele2 = params.allelecutoff
+            allele1 = params.allelecutoff
         else:
             allele2 = allele1
 
-    elif np.isnan(allele1) & (not np.isnan(allele2)):
-        if (allele2 >= args.allelecutoff):
-            allele1 = args.allelecutoff
-            allele2 = args.allelecutoff
+    elif math.isnan(allele1) & (not math.isnan(allele2)):
+        if (allele2 >= params.allelecutoff):
+            allele1 = params.allelecutoff
+            allele2 = params.allelecutoff
         else:
             allele1 = allele2
 
-    elif (allele2 >= args.allelecutoff):
-            if (allele1 >= args.allelecutoff):
-                allele2 = args.allelecutoff
-                allele1 = args.allelecutoff
+    elif (allele2 >= params.allelecutoff):
+            if (allele1 >= params.allelecutoff):
+                allele2 = params.allelecutoff
+                allele1 = params.allelecutoff
             else:
-                allele2 = args.allelecutoff
+                allele2 = params.allelecutoff
 
-    elif (allele1 >= args.allelecutoff):
-        allele1 = args.allelecutoff
-        allele2 = args.allelecutoff
+    elif (allele1 >= params.allelecutoff):
+        allele1 = params.allelecutoff
+        allele2 = params.allelecutoff
 
     else:
         allele1 = allele1
@@ -139,10 +331,10 @@ def nan_allele_check(allele1, allele2, ):
 
     Returns: allele1, allele2 (float): nan-replaced alleles"""
 
-    if (not np.isnan(allele1)) & np.isnan(allele2):
+    if (not math.isnan(allele1)) & math.isnan(allele2):
             allele2 = allele1
 
-    elif np.isnan(allele1) & (not np.isnan(allele2)):
+    elif math.isnan(allele1) & (not math.isnan(allele2)):
             allele1 = allele2
 
     else:
@@ -151,7 +343,7 @@ def nan_allele_check(allele1, allele2, ):
 
     return allele1, allele2
 
-def wiggle(allele, args):
+def wiggle(allele, params):
     """This function establishes a range per allele to account for error in
     measurement/evaluation of alleles as determined by the wiggle
     (proportion to be +/- based on allele) and minwiggle, the minimum set wiggle
@@ -164,20 +356,16 @@ def wiggle(allele, args):
     Returns:
             (a1, a2) (tuple): the parent allele range to match a kid allele"""
 
-    if (args.wiggle > 1.0) or (args.wiggle < 0.0):
-        raise ValueError('wiggle proportion must be a value between 0 and 1')
-
-    elif allele * (args.wiggle) < args.minwig:
-         (a1, a2) = (allele - args.minwig, allele + args.minwig)
+    if allele < params.switchover:
+         (a1, a2) = (allele - params.minwig, allele + params.minwig)
 
     else:
-         (a1, a2) = (allele * (1 - args.wiggle),
-                    allele * (1 + args.wiggle))
+         (a1, a2) = (allele * params.low, allele * params.high)
 
     return (a1, a2)
 
 
-def allele_range(allele1, allele2, args):
+def allele_range(allele1, allele2, params):
     """Here we generate the allele ranges for both alleles from a parent using
     the other function wiggle.
 
@@ -187,20 +375,18 @@ def allele_range(allele1, allele2, args):
     Returns:
         a1_range, a2_range (tuples): the two ranges, one tuple per allele"""
 
-    a1_range = wiggle(allele1, args)
-    a2_range = wiggle(allele2, args)
+    a1_range = wiggle(allele1, params)
+    a2_range = wiggle(allele2, params)
 
     return a1_range, a2_range
 
 
-def check_range(allele1, allele2, kidallele, args):
-    """Here we compare a kid allele to the parental alleles, which are run
-    through the get_allele_ranges function to generate the final allele ranges.
-    There are various returned values in case we wish to capture this output
-    later, that can be easily added to the output file
+def in_range(a1_range, a2_range, kidallele, params):
+    """Compare a kid allele to a parent's precomputed allele ranges, so the
+    ranges for each parent only need to be built once per locus.
 
     Parameters:
-        allele1, allele2 (float): the two alleles of a parent
+        a1_range, a2_range (tuples): the parent's ranges from allele_range
         kidallele (float): kid's allele being compared to the parental alleles
 
     Return:
@@ -208,11 +394,10 @@ def check_range(allele1, allele2, kidallele, args):
             True if there is a match between kid and parent
             False, otherwise"""
 
-    a1_range, a2_range = allele_range(allele1, allele2, args)
     a1_low, a1_high = a1_range
     a2_low, a2_high = a2_range
 
-    if kidallele < args.allelecutoff:
+    if kidallele < params.allelecutoff:
         if (a1_low <= kidallele <= a1_high) | (a2_low <= kidallele <= a2_high):
             return True
         else:
@@ -220,12 +405,55 @@ def check_range(allele1, allele2, kidallele, args):
 
     else:
         # If both kid and parent allele exceed threshold, they match
-        if (a1_high >= args.allelecutoff) | (a2_high >= args.allelecutoff):
+        if (a1_high >= params.allelecutoff) | (a2_high >= params.allelecutoff):
             return True
         else:
             return False #'Amplification'
 
-def full_allele_check(momalleledict, dadalleledict, kidalleledict, args):
+def check_range(allele1, allele2, kidallele, params):
+    """Here we compare a kid allele to the parental alleles, which are run
+    through the get_allele_ranges function to generate the final allele ranges.
+    There are various returned values in case we wish to capture this output
+    later, that can be easily added to the output file
+
+    Parameters:
+        allele1, allele2 (float): the two alleles of a parent
+        kidallele (float): kid's allele being compared to the parental alleles
+
+    Return:
+        bool:
+            True if there is a match between kid and parent
+            False, otherwise"""
+
+    a1_range, a2_range = allele_range(allele1, allele2, params)
+
+    return in_range(a1_range, a2_range, kidallele, params)
+
+def allele_diffs(kid1, kid2, lst1, lst2):
+    """The allele difference columns for a trio: kid allele 1 is compared to
+    the closest of one parent's alleles and kid allele 2 to the other's.
+
+    Parameters:
+        kid1, kid2 (float): the kid's two alleles
+        lst1, lst2 (list): the alleles of the parent matched to kid1, kid2
+
+    Returns:
+        allele1diff, allele2diff (float): kid allele minus closest allele
+        percentdiff1, percentdiff2 (float): difference as a proportion of
+        the closest allele, NaN when that allele is 0"""
+
+    allele1diff = allele_diff(lst1, kid1)
+    allele2diff = allele_diff(lst2, kid2)
+    percentdiff1 = math.nan
+    percentdiff2 = math.nan
+    if (kid1 - allele1diff) != 0:
+        percentdiff1 = allele1diff/abs((kid1 - allele1diff))
+    if (kid2 - allele2diff) != 0:
+        percentdiff2 = allele2diff/abs((kid2 - allele2diff))
+
+    return allele1diff, allele2diff, percentdiff1, percentdiff2
+
+def full_allele_check(momalleledict, dadalleledict, kidalleledict, params):
     """This is the final kit'n'kaboodle for the script: here, we evaluate the
     trio to make sure we have sufficient alleles to run the comparison, and then
     if we do, we standardize all alleles and compare the kid alleles to the
@@ -258,220 +486,88 @@ def full_allele_check(momalleledict, dadalleledict, kidalleledict, args):
                 True if the difference between largest allele is > ampsize
                 for kid compared to both parents in an MV, OR in a double MV
                 if includeDMV is set to Yes
-                False in all other cases"""
+                False in all other cases
+
+            + with includeallelediff, the four columns from allele_diffs"""
+
+    kid1, kid2 = kidalleledict['allele1'], kidalleledict['allele2']
+    mom1, mom2 = momalleledict['allele1'], momalleledict['allele2']
+    dad1, dad2 = dadalleledict['allele1'], dadalleledict['allele2']
 
     # if any of the trio has both missing alleles, then we are out of there
-    if (np.isnan(kidalleledict['allele1']) & np.isnan(kidalleledict['allele2'])) or (
-            np.isnan(momalleledict['allele1']) & np.isnan(momalleledict['allele2'])) or (
-            np.isnan(dadalleledict['allele1']) & np.isnan(dadalleledict['allele2'])):
-            if args.includeallelediff == 'Yes':
-                return 'Missing alleles, ignore', False, np.nan, np.nan, np.nan, np.nan
+    if (math.isnan(kid1) and math.isnan(kid2)) or (
+            math.isnan(mom1) and math.isnan(mom2)) or (
+            math.isnan(dad1) and math.isnan(dad2)):
+            if params.includeallelediff:
+                return 'Missing alleles, ignore', False, math.nan, math.nan, math.nan, math.nan
             else:
                 return 'Missing alleles, ignore', False
-    # taking max allele to assess existence of amplification over threshold
-    kidalleledict["compallele"] = max(kidalleledict['allele1'], kidalleledict['allele2'])
-    momalleledict["compallele"] = max(momalleledict['allele1'], momalleledict['allele2'])
-    dadalleledict["compallele"] = max(dadalleledict['allele1'], dadalleledict['allele2'])
-
-    # here we have the standardized alleles for the full allele check
-    kidalleledict['allele1_std'], kidalleledict['allele2_std'] = allele_check(
-    kidalleledict['allele1'], kidalleledict['allele2'], args)
-
-    momalleledict['allele1_std'], momalleledict['allele2_std'] = allele_check(
-    momalleledict['allele1'], momalleledict['allele2'], args)
-
-    dadalleledict['allele1_std'], dadalleledict['allele2_std'] = allele_check(
-    dadalleledict['allele1'], dadalleledict['allele2'], args)
-
-    percentdiff1 = np.nan
-    percentdiff2 = np.nan
-    if args.includeallelediff == 'Yes':
-    #here is  the nan_allele_check for the allelediff calculations
-        kidalleledict['allele1'], kidalleledict['allele2'] = nan_allele_check(
-        kidalleledict['allele1'], kidalleledict['allele2'], )
-
-        momalleledict['allele1'], momalleledict['allele2'] = nan_allele_check(
-        momalleledict['allele1'], momalleledict['allele2'], )
-
-        dadalleledict['allele1'], dadalleledict['allele2'] = nan_allele_check(
-        dadalleledict['allele1'], dadalleledict['allele2'])
-    else:
-        pass
-
-    kidallele1_matches_mom = check_range(momalleledict['allele1_std'],
-                    momalleledict['allele2_std'], kidalleledict['allele1_std'], args)
-
-    kidallele1_matches_dad = check_range(dadalleledict['allele1_std'],
-                    dadalleledict['allele2_std'], kidalleledict['allele1_std'], args)
-
-    kidallele2_matches_mom = check_range(momalleledict['allele1_std'],
-                    momalleledict['allele2_std'], kidalleledict['allele2_std'], args)
-
-    kidallele2_matches_dad = check_range(dadalleledict['allele1_std'],
-                    dadalleledict['allele2_std'], kidalleledict['allele2_std'], args)
 
-    if args.includeallelediff == 'Yes':
-        lstmom = [momalleledict['allele1'], momalleledict['allele2']]
-        lstdad = [dadalleledict['allele1'], dadalleledict['allele2']]
-        biglst = lstmom + lstdad
-    else:
-        pass
+    # taking max allele to assess existence of amplification over threshold
+    # (in a double MV only when includeDMV is set)
+    kidcomp = max(kid1, kid2)
+    amplified = (kidcomp - max(dad1, dad2) >= params.ampsize) and (
+                kidcomp - max(mom1, mom2) >= params.ampsize)
+
+    # here we have the standardized alleles for the full allele check, where
+    # each parent's ranges are shared by both kid alleles
+    kid1_std, kid2_std = allele_check(kid1, kid2, params)
+    momranges = allele_range(*allele_check(mom1, mom2, params), params)
+    dadranges = allele_range(*allele_check(dad1, dad2, params), params)
+
+    kidallele1_matches_mom = in_range(*momranges, kid1_std, params)
+    kidallele1_matches_dad = in_range(*dadranges, kid1_std, params)
+    kidallele2_matches_mom = in_range(*momranges, kid2_std, params)
+    kidallele2_matches_dad = in_range(*dadranges, kid2_std, params)
 
     # kid allele 1 matches mom, kid allele 2 matches dad, we're golden
     if kidallele1_matches_mom and kidallele2_matches_dad:
-        if args.includeallelediff == 'Yes':
-            allele1diff = allele_diff(lstmom, kidalleledict['allele1'])
-            allele2diff = allele_diff(lstdad, kidalleledict['allele2'])
-            if (kidalleledict['allele1'] - allele1diff) != 0:
-                percentdiff1 = allele1diff/abs((kidalleledict['allele1'] - allele1diff))
-            if (kidalleledict['allele2'] - allele2diff) != 0:
-                percentdiff2 = allele2diff/abs((kidalleledict['allele2'] - allele2diff))
-            return 'Full match', False, allele1diff, allele2diff, percentdiff1, percentdiff2
-        else:
-            return 'Full match', False
+        status, amp, kid1_parent = 'Full match', False, 'mom'
 
     # allele 2 matches mom and allele 1 matches dad
     elif kidallele2_matches_mom and kidallele1_matches_dad:
-        if args.includeallelediff == 'Yes':
-            allele1diff = allele_diff(lstdad, kidalleledict['allele1'])
-            allele2diff = allele_diff(lstmom, kidalleledict['allele2'])
-            if (kidalleledict['allele1'] - allele1diff) != 0:
-                percentdiff1 = allele1diff/abs((kidalleledict['allele1'] - allele1diff))
-            if (kidalleledict['allele2'] - allele2diff) != 0:
-                percentdiff2 = allele2diff/abs((kidalleledict['allele2'] - allele2diff))
-            return 'Full match', False, allele1diff, allele2diff, percentdiff1, percentdiff2
-        else:
-            return 'Full match', False
-
-    elif (kidallele1_matches_mom, kidallele1_matches_dad,
-                            kidallele2_matches_mom, kidallele2_matches_dad
-                                        ) == (False, False, False, False):
-        if args.includeDMV == 'Yes':
-            if (kidalleledict['compallele'] - dadalleledict['compallele'] >= args.ampsize
-                ) & (kidalleledict['compallele'] - momalleledict['compallele'] >= args.ampsize):
-                if args.includeallelediff == 'Yes':
-                    closeallele2 = closest(biglst, kidalleledict['allele2'])
-                    if closeallele2 in lstmom:
-                        allele2diff = allele_diff(lstmom, kidalleledict['allele2'])
-                        allele1diff = allele_diff(lstdad, kidalleledict['allele1'])
-                    else:
-                        allele2diff = allele_diff(lstdad, kidalleledict['allele2'])
-                        allele1diff = allele_diff(lstmom, kidalleledict['allele1'])
-                    if (kidalleledict['allele1'] - allele1diff) != 0:
-                        percentdiff1 = allele1diff/abs((kidalleledict['allele1'] - allele1diff))
-                    if (kidalleledict['allele2'] - allele2diff) != 0:
-                        percentdiff2 = allele2diff/abs((kidalleledict['allele2'] - allele2diff))
-                    return 'Double MV, likely error', True, allele1diff, allele2diff, percentdiff1, percentdiff2
-                else:
-                    return 'Double MV, likely error', True
+        status, amp, kid1_parent = 'Full match', False, 'dad'
 
-            else:
-                if args.includeallelediff == 'Yes':
-                    closeallele2 = closest(biglst, kidalleledict['allele2'])
-                    if closeallele2 in lstmom:
-                        allele2diff = allele_diff(lstmom, kidalleledict['allele2'])
-                        allele1diff = allele_diff(lstdad, kidalleledict['allele1'])
-                    else:
-                        allele2diff = allele_diff(lstdad, kidalleledict['allele2'])
-                        allele1diff = allele_diff(lstmom, kidalleledict['allele1'])
-                    if (kidalleledict['allele1'] - allele1diff) != 0:
-                        percentdiff1 = allele1diff/abs((kidalleledict['allele1'] - allele1diff))
-                    if (kidalleledict['allele2'] - allele2diff) != 0:
-                        percentdiff2 = allele2diff/abs((kidalleledict['allele2'] - allele2diff))
-                    return 'Double MV, likely error', False, allele1diff, allele2diff, percentdiff1, percentdiff2
-                else:
-                    return 'Double MV, likely error', False
-
-        elif args.includeDMV == 'No':
-            if args.includeallelediff == 'Yes':
-                closeallele2 = closest(biglst, kidalleledict['allele2'])
-                if closeallele2 in lstmom:
-                    allele2diff = allele_diff(lstmom, kidalleledict['allele2'])
-                    allele1diff = allele_diff(lstdad, kidalleledict['allele1'])
-                else:
-                    allele2diff = allele_diff(lstdad, kidalleledict['allele2'])
-                    allele1diff = allele_diff(lstmom, kidalleledict['allele1'])
-                if (kidalleledict['allele1'] - allele1diff) != 0:
-                    percentdiff1 = allele1diff/abs((kidalleledict['allele1'] - allele1diff))
-                if (kidalleledict['allele2'] - allele2diff) != 0:
-                    percentdiff2 = allele2diff/abs((kidalleledict['allele2'] - allele2diff))
-                return 'Double MV, likely error', False, allele1diff, allele2diff, percentdiff1, percentdiff2
-            else:
-                return 'Double MV, likely error', False
-        else:
-            raise ValueError('IncludeDMV argument must be exact')
+    elif not (kidallele1_matches_mom or kidallele1_matches_dad or
+                kidallele2_matches_mom or kidallele2_matches_dad):
+        status, amp, kid1_parent = ('Double MV, likely error',
+                                    params.includeDMV and amplified, None)
 
     else:
-        if (kidalleledict['compallele'] - dadalleledict['compallele'] >= args.ampsize
-            ) & (kidalleledict['compallele'] - momalleledict['compallele'] >= args.ampsize):
-            if args.includeallelediff == 'Yes':
-                closeallele2 = closest(biglst, kidalleledict['allele2'])
-                if closeallele2 in lstmom:
-                    allele2diff = allele_diff(lstmom, kidalleledict['allele2'])
-                    allele1diff = allele_diff(lstdad, kidalleledict['allele1'])
-                else:
-                    allele2diff = allele_diff(lstdad, kidalleledict['allele2'])
-                    allele1diff = allele_diff(lstmom, kidalleledict['allele1'])
-                if (kidalleledict['allele1'] - allele1diff) != 0:
-                    percentdiff1 = allele1diff/abs((kidalleledict['allele1'] - allele1diff))
-                if (kidalleledict['allele2'] - allele2diff) != 0:
-                    percentdiff2 = allele2diff/abs((kidalleledict['allele2'] - allele2diff))
-                return 'MV', True, allele1diff, allele2diff, percentdiff1, percentdiff2
-            else:
-                return 'MV', True
+        status, amp, kid1_parent = 'MV', amplified, None
+
+    if not params.includeallelediff:
+        return status, amp
 
+    #here is  the nan_allele_check for the allelediff calculations
+    kid1, kid2 = nan_allele_check(kid1, kid2)
+    lstmom = list(nan_allele_check(mom1, mom2))
+    lstdad = list(nan_allele_check(dad1, dad2))
+
+    # without a full match, kid allele 2 is compared to the parent with the
+    # closest allele, and kid allele 1 to the other parent
+    if kid1_parent is None:
+        if closest(lstmom + lstdad, kid2) in lstmom:
+            kid1_parent = 'dad'
         else:
-            if args.includeallelediff == 'Yes':
-                closeallele2 = closest(biglst, kidalleledict['allele2'])
-                if closeallele2 in lstmom:
-                    allele2diff = allele_diff(lstmom, kidalleledict['allele2'])
-                    allele1diff = allele_diff(lstdad, kidalleledict['allele1'])
-                else:
-                    allele2diff = allele_diff(lstdad, kidalleledict['allele2'])
-                    allele1diff = allele_diff(lstmom, kidalleledict['allele1'])
-                if (kidalleledict['allele1'] - allele1diff) != 0:
-                    percentdiff1 = allele1diff/abs((kidalleledict['allele1'] - allele1diff))
-                if (kidalleledict['allele2'] - allele2diff) != 0:
-                    percentdiff2 = allele2diff/abs((kidalleledict['allele2'] - allele2diff))
-                return 'MV', False, allele1diff, allele2diff, percentdiff1, percentdiff2
-            else:
-                return 'MV', False
+            kid1_parent = 'mom'
 
-def strlingMV(df, kid, mom, dad, mutation, args, writeHeader = True):
-    """Generate .tsv file(s) with pedigree input and STRling data that has
-    information about the Mendelian status of the trio (whether kid is a
-    full match to parents, has one Mendelian violation, etc.) as well as
-    whether the kid has an amplification  (set by the argumpent ampsize)
-    compared to both parents.
+    if kid1_parent == 'mom':
+        return (status, amp) + allele_diffs(kid1, kid2, lstmom, lstdad)
+    else:
+        return (status, amp) + allele_diffs(kid1, kid2, lstdad, lstmom)
 
-    Only trios where all three members' loci pass a depth filter will
-    have information reported.
-    This function is also responsible for printing the Mendelian status value
-    count and the novel amplification count per sample.
+def prepare_members(df, dfkid, dfmom, dfdad):
+    """Get the outlier rows of each trio member ready to merge: the depth and
+    allele columns are renamed per member, alleles are converted from repeat
+    units to base pairs, and the columns we don't report are dropped.
 
     Parameters:
-        df (dataframe): dataframe of STRling outlier data
-        kid (str): sample ID for kid
-        mom (str): sample ID for mom
-        dad (str): sample ID for dad
-        mutation (str): mutation implicated in trio
-        writeHeader (boolean): adds header to beginning of file, once
+        df (dataframe): dataframe of STRling outlier data, for its columns
+        dfkid, dfmom, dfdad (dataframes): outlier rows of each member
 
     Returns:
-            Altered dataframe with full_allele_check strings for mendelianstatus
-            column and True/False value for novel_amp (novel amplification)"""
-
-    # match the data frame to the samples of the individual or "kid"
-    dfkid = df.loc[df['sample'] == kid]
-    dfkid['mutation'] = mutation
-
-    # add a new column matched by sample mutation from mom and dad
-    dfkid['mom'] = mom
-    dfkid['dad'] = dad
-
-    # this is how we match our pedigree samples to our data frame samples
-    dfmom = df.loc[df['sample'] == mom]
-    dfdad = df.loc[df['sample'] == dad]
+        dfkid, dfmom, dfdad (dataframes): the members' rows, ready to merge"""
 
     # since we are comparing alleles from kid to parents,
     # using depth as a filter, we need to distinguish alleles in the final df
@@ -543,62 +639,68 @@ def strlingMV(df, kid, mom, dad, mutation, args, writeHeader = True):
     # we are dropping as many columns as we can for a clean output
     #while still getting essential information
 
-    kiddad = dfkid.merge(dfdad, on = 'locus')
-    kiddadmom = kiddad.merge(dfmom, on = 'locus')
-    kiddadmom = kiddadmom.drop('repeatlen_x', axis=1)
-    kiddadmom = kiddadmom.drop('repeatlen_y', axis=1)
+    return dfkid, dfmom, dfdad
+
+# the merged trio columns classify_loci reads for every locus
+LOCUS_COLUMNS = ['allele1kid', 'allele2kid', 'allele1mom', 'allele2mom',
+                'allele1dad', 'allele2dad', 'depth_kid', 'depth_mom', 'depth_dad']
 
-    # we are going to iterate row by row to create dictionaries
-    for index, row in kiddadmom.iterrows():
-        kidalleledict = {}
-        momalleledict = {}
-        dadalleledict = {}
-        kidalleledict = {
-            "allele1": row["allele1kid"],
-            "allele2": row["allele2kid"],
-        }
+def classify_loci(kiddadmom, params):
+    """Run full_allele_check on every merged trio locus that passes the depth
+    filter, adding the mendelianstatus and novel_amp columns (and the allele
+    difference columns with includeallelediff).
 
-        momalleledict = {
-            "allele1": row["allele1mom"],
-            "allele2": row["allele2mom"],
-        }
+    Parameters:
+        kiddadmom (dataframe): merged kid, dad and mom loci
+        params (Params): classification parameters
 
-        dadalleledict = {
-            "allele1": row["allele1dad"],
-            "allele2": row["allele2dad"],
-        }
+    Returns:
+        (dataframe): the classified loci that passed the depth filter"""
+
+    columns = ['mendelianstatus', 'novel_amp']
+    filtered = ('under depth filter', 'under depth filter')
+    if params.includeallelediff:
+        columns += ['allele1diff', 'allele2diff', 'percentdiff1', 'percentdiff2']
+        filtered += (math.nan, math.nan, math.nan, math.nan)
+
+    # we go locus by locus over plain lists of the columns we need, and then
+    # add each new column to the data frame in one go
+    results = []
+    for (kid1, kid2, mom1, mom2, dad1, dad2, depthkid, depthmom,
+            depthdad) in zip(*(kiddadmom[column].tolist() for column in
+            LOCUS_COLUMNS)):
+        if (depthkid >= params.depth and depthmom >= params.depth and
+                depthdad >= params.depth):
+            results.append(full_allele_check(
+                {'allele1': mom1, 'allele2': mom2},
+                {'allele1': dad1, 'allele2': dad2},
+                {'allele1': kid1, 'allele2': kid2}, params))
+        else:
+            results.append(filtered)
 
-        if ((row['depth_kid'] >= args.depth) & (row['depth_mom'
-                    ] >= args.depth) & (row['depth_dad'] >= args.depth)):
-            if args.includeallelediff == 'Yes':
-                row['mendelianstatus'], row['novel_amp'], row['allele1diff'], row['allele2diff'], row['percentdiff1'], row['percentdiff2'] = full_allele_check(momalleledict, dadalleledict, kidalleledict, args)
+    # a trio with no shared loci still gets the classification columns, so
+    # the header is the same whatever trio is written first
+    values = list(zip(*results)) or [()] * len(columns)
+    for column, value in zip(columns, values):
+        kiddadmom[column] = list(value)
 
+    # drop any rows that didn't meet the depth filter
+    kiddadmom = kiddadmom[kiddadmom.mendelianstatus != 'under depth filter']
 
-            else:
-                row['mendelianstatus'], row['novel_amp'] = full_allele_check(
-            momalleledict, dadalleledict, kidalleledict, args)
-        else:
-            if args.includeallelediff == 'Yes':
-                row['mendelianstatus'] = 'under depth filter'
-                row['novel_amp'] = 'under depth filter'
-                row['allele1diff'] = np.nan
-                row['allele2diff'] = np.nan
-                row['percentdiff1'] = np.nan
-                row['percentdiff2'] = np.nan
-            else:
-                row['mendelianstatus'] = 'under depth filter'
-                row['novel_amp'] = 'under depth filter'
-
-        # we add our new column to the main data frame
-        kiddadmom.at[index, 'mendelianstatus'] = row['mendelianstatus']
-        kiddadmom.at[index, 'novel_amp'] = row['novel_amp']
-        if args.includeallelediff == 'Yes':
-            kiddadmom.at[index, 'allele1diff'] = row['allele1diff']
-            kiddadmom.at[index, 'allele2diff'] = row['allele2diff']
-            kiddadmom.at[index, 'percentdiff1'] = row['percentdiff1']
-            kiddadmom.at[index, 'percentdiff2'] = row['percentdiff2']
-        # drop any rows that didn't meet the depth filter
-        kiddadmom = kiddadmom[kiddadmom.mendelianstatus != 'under depth filter']
+    return kiddadmom
+
+def write_trio(kiddadmom, kid, nloci, args, writeHeader):
+    """Append a kid's classified loci to args.out and print the Mendelian
+    status and novel amp counts for the kid.
+
+    Parameters:
+        kiddadmom (dataframe): the kid's classified loci
+        kid (str): sample ID for kid
+        nloci (int): loci shared by the trio, before the depth filter
+        writeHeader (boolean): adds header to beginning of file, once
+
+    Returns:
+        (int): the number of rows written"""
 
     if writeHeader is True:
         kiddadmom.to_csv(args.out, mode='a', sep='\t', header=True, index=False)
@@ -608,44 +710,426 @@ def strlingMV(df, kid, mom, dad, mutation, args, writeHeader = True):
     else:
         kiddadmom.to_csv(args.out, mode='a',sep='\t', header=False, index=False)
 
-    if hasattr(kiddadmom, 'mendelianstatus'):
+    if nloci > 0:
         print('Mendelian status and novel amp counts for', kid)
         print(kiddadmom.mendelianstatus.value_counts())
         print(kiddadmom.novel_amp.value_counts())
     else:
         pass
+
+    return len(kiddadmom)
+
+def strlingMV(df, kid, mom, dad, mutation, args, writeHeader = True,
+            params = None):
+    """Generate .tsv file(s) with pedigree input and STRling data that has
+    information about the Mendelian status of the trio (whether kid is a
+    full match to parents, has one Mendelian violation, etc.) as well as
+    whether the kid has an amplification  (set by the argumpent ampsize)
+    compared to both parents.
+
+    Only trios where all three members' loci pass a depth filter will
+    have information reported.
+    This function is also responsible for printing the Mendelian status value
+    count and the novel amplification count per sample.
+
+    Parameters:
+        df (dataframe): dataframe of STRling outlier data
+        kid (str): sample ID for kid
+        mom (str): sample ID for mom
+        dad (str): sample ID for dad
+        mutation (str): mutation implicated in trio
+        writeHeader (boolean): adds header to beginning of file, once
+        params (Params): classification parameters, built from args if
+        not given
+
+    Returns:
+            Writes the altered dataframe with full_allele_check strings for
+            mendelianstatus column and True/False value for novel_amp (novel
+            amplification) to args.out, and returns the number of shared trio
+            loci and the number of rows written that passed the depth filter"""
+
+    if params is None:
+        params = get_params(args)
+
+    # match the data frame to the samples of the individual or "kid"
+    dfkid = df.loc[df['sample'] == kid]
+    dfkid['mutation'] = mutation
+
+    # add a new column matched by sample mutation from mom and dad
+    dfkid['mom'] = mom
+    dfkid['dad'] = dad
+
+    # this is how we match our pedigree samples to our data frame samples
+    dfmom = df.loc[df['sample'] == mom]
+    dfdad = df.loc[df['sample'] == dad]
+
+    dfkid, dfmom, dfdad = prepare_members(df, dfkid, dfmom, dfdad)
+
+    kiddad = dfkid.merge(dfdad, on = 'locus')
+    kiddadmom = kiddad.merge(dfmom, on = 'locus')
+    kiddadmom = kiddadmom.drop('repeatlen_x', axis=1)
+    kiddadmom = kiddadmom.drop('repeatlen_y', axis=1)
+    nloci = len(kiddadmom)
+
+    kiddadmom = classify_loci(kiddadmom, params)
+    rows = write_trio(kiddadmom, kid, nloci, args, writeHeader)
+
     #my_small_df = (kiddadmom, 'Kid, mom, and dad sample IDs are', kid, mom, dad)
-    return #my_small_df if I want the dataframe as an object
+    return nloci, rows #my_small_df if I want the dataframe as an object
+
+def merge_names(kidcols, dadcols, momcols):
+    """The column names that merging kid with dad, and then with mom, on
+    locus gives: pandas adds _x/_y to the columns two frames share. Renaming
+    up front lets a family join the parents once and still end up with the
+    same columns as strlingMV.
+
+    Parameters:
+        kidcols, dadcols, momcols (list): each member's columns after
+        prepare_members
+
+    Returns:
+        kidnames, dadnames, momnames (dict): new name for each column"""
+
+    kidnames = {col: col + '_x' if col in dadcols else col for col in kidcols}
+    dadnames = {col: col + '_y' if col in kidcols else col for col in dadcols}
+    kiddadcols = list(kidnames.values()) + list(dadnames.values())
+    for names in (kidnames, dadnames):
+        for col, name in names.items():
+            if name in momcols:
+                names[col] = name + '_x'
+    momnames = {col: col + '_y' if col in kiddadcols else col for col in momcols}
+
+    for names in (kidnames, dadnames, momnames):
+        names.pop('locus', None)
+
+    return kidnames, dadnames, momnames
+
+def family_strlingMV(df, trios, args, params = None):
+    """The family version of strlingMV for siblings that share a mom and dad:
+    the parents' loci are prepared and joined once for the couple, all the
+    siblings are joined against them in one merge and classified together,
+    and then the rows are split back out per kid.
+
+    Parameters:
+        df (dataframe): dataframe of STRling outlier data
+        trios (list): Trio tuples for the siblings, all with the same parents
+        params (Params): classification parameters, built from args if
+        not given
+
+    Returns:
+        (list): per trio, in the order given, the kid's classified loci and
+        the number of loci the trio shared before the depth filter"""
+
+    import pandas as pd
+
+    if params is None:
+        params = get_params(args)
+    kids = [trio.kid for trio in trios]
+    mom, dad = trios[0].mom, trios[0].dad
+
+    # one pass over the outliers for the whole family, then each kid's rows
+    # in the same order a per-trio selection would give
+    family = df.loc[df['sample'].isin(kids + [mom, dad])]
+    dfkid = pd.concat([family.loc[family['sample'] == kid] for kid in kids])
+    dfkid['mutation'] = dfkid['sample'].map(
+                            {trio.kid: trio.mutation for trio in trios})
+    dfkid['mom'] = mom
+    dfkid['dad'] = dad
+    dfmom = family.loc[family['sample'] == mom]
+    dfdad = family.loc[family['sample'] == dad]
+
+    dfkid, dfmom, dfdad = prepare_members(df, dfkid, dfmom, dfdad)
+    kidnames, dadnames, momnames = merge_names(list(dfkid.columns),
+                                    list(dfdad.columns), list(dfmom.columns))
+
+    # the parental locus table is built once, and every sibling joins it
+    parents = dfdad.rename(columns = dadnames).merge(
+                dfmom.rename(columns = momnames), on = 'locus')
+    siblings = dfkid.rename(columns = kidnames).merge(parents, on = 'locus')
+    siblings = siblings.drop(['repeatlen_x', 'repeatlen_y'], axis=1)
+    nloci = siblings['sample'].value_counts()
+
+    siblings = classify_loci(siblings, params)
+
+    return [(siblings.loc[siblings['sample'] == kid], int(nloci.get(kid, 0)))
+            for kid in kids]
+
+def group_families(planned):
+    """Group the planned trios by parents, so siblings can be run together.
+    Families come in the order of their first kid, and kids keep their order
+    within a family.
+
+    Parameters:
+        planned (list): (trio, work) from plan_trios
+
+    Returns:
+        (list): (family, work) per couple, where family is the list of the
+        couple's (trio, work) entries and work is their total"""
+
+    families = collections.OrderedDict()
+    for trio, work in planned:
+        families.setdefault((trio.mom, trio.dad), []).append((trio, work))
+
+    return [(family, sum(work for trio, work in family))
+            for family in families.values()]
+
+class Progress:
+    """Throughput and progress telemetry for get_denovos. Updated once per
+    trio, so the per-locus work is untouched; a report is emitted at most
+    every interval seconds, either as a line on stderr or as a JSON line
+    appended to a metrics file.
+
+    Loci per second and trio latency are taken over the last window trios,
+    so they follow the current speed; the lifetime loci per second is kept
+    alongside. The ETA is based on the planned work (outlier rows) still to
+    do and the rate at which this run has been getting through it."""
+
+    def __init__(self, trios, interval, metrics = None, done = (), window = 20):
+        """
+        Parameters:
+            trios (list): the planned (trio, work) entries for this run
+            interval (float): seconds between reports, 0 for no reports
+            metrics (str): JSON lines file for reports, None for stderr
+            done (set): kids already completed by an earlier run
+            window (int): number of trios in the rolling rates"""
+
+        self.interval = interval
+        self.metrics = metrics
+        self.total = len(trios)
+        self.done = sum(1 for trio, work in trios if trio.kid in done)
+        self.remaining_work = sum(work for trio, work in trios
+                                    if trio.kid not in done)
+        self.work = 0
+        self.loci = 0
+        self.rows = 0
+        self.latencies = collections.deque(maxlen = window)
+        self.batch_shares = {}
+        self.reported = None
+        self.start = self.last_trio = self.last_report = time.monotonic()
+        # (time, loci so far) at the start of the window and after each trio
+        self.recent = collections.deque([(self.start, 0)], maxlen = window + 1)
+
+    def batch(self, kids):
+        """Mark a batch of trios (a --families family) as classified together,
+        before their updates: the time the batch took is split evenly between
+        its kids' latencies, on top of each one's own writing time."""
+
+        now = time.monotonic()
+        share = (now - self.last_trio) / len(kids)
+        self.batch_shares.update((kid, share) for kid in kids)
+        self.last_trio = now
+
+    def update(self, work, loci, rows, kid = None):
+        """Record a finished trio, and report if the interval has passed"""
+
+        now = time.monotonic()
+        self.latencies.append(now - self.last_trio +
+                                self.batch_shares.pop(kid, 0.0))
+        self.last_trio = now
+        self.done += 1
+        self.work += work
+        self.remaining_work -= work
+        self.loci += loci
+        self.rows += rows
+        self.recent.append((now, self.loci))
+        if self.interval > 0 and now - self.last_report >= self.interval:
+            self.report(now)
+
+    def snapshot(self, now):
+        """The current telemetry as a dictionary"""
+
+        elapsed = now - self.start
+        rate = self.work / elapsed if elapsed > 0 else 0.0
+        eta = self.remaining_work / rate if rate > 0 else None
+        latency = (sum(self.latencies) / len(self.latencies)
+                    if self.latencies else None)
+        since, loci = self.recent[0]
+        recent = now - since
+
+        return {'trios_done': self.done, 'trios_total': self.total,
+                'loci': self.loci, 'rows_written': self.rows,
+                'elapsed_s': round(elapsed, 3),
+                'loci_per_s': round((self.loci - loci) / recent, 3) if recent > 0 else 0.0,
+                'loci_per_s_total': round(self.loci / elapsed, 3) if elapsed > 0 else 0.0,
+                'trio_latency_s': None if latency is None else round(latency, 3),
+                'eta_s': None if eta is None else round(eta, 3)}
+
+    def report(self, now = None):
+        """Emit a report now, to the metrics file or to stderr"""
+
+        if now is None:
+            now = time.monotonic()
+        self.last_report = now
+        self.reported = self.done
+        snapshot = self.snapshot(now)
+        if self.metrics is not None:
+            with open(self.metrics, 'a') as outfile:
+                outfile.write(json.dumps(snapshot) + '\n')
+        else:
+            # no latency or ETA until the first trio is done
+            shown = dict(snapshot, **{key: '-' if snapshot[key] is None
+                            else '%s s' % snapshot[key]
+                            for key in ('trio_latency_s', 'eta_s')})
+            print('trios %(trios_done)d/%(trios_total)d, %(loci_per_s).1f loci/s, '
+                    '%(rows_written)d rows written, trio latency %(trio_latency_s)s, '
+                    'ETA %(eta_s)s' % shown, file = sys.stderr)
+
+    def finish(self):
+        """Emit a final report, unless the last one is already up to date"""
+
+        if self.interval > 0 and self.reported != self.done:
+            self.report()
+
+# parameters that change the output; a resumed run must match all of them
+# (the inputs themselves are compared by fingerprint, not by path)
+MANIFEST_PARAMS = ['wiggle', 'minwig', 'depth', 'ampsize', 'allelecutoff',
+                    'includeDMV', 'includeallelediff', 'shard', 'families']
+
+def manifest_path(args):
+    """The checkpoint manifest is a small JSON sidecar next to the output file"""
+
+    return args.out + '.manifest.json'
+
+def fingerprint(filename):
+    """Hash an input file so a resumed run can tell whether it has changed.
+    The whole file is hashed, in chunks; get_denovos reads all of the
+    outliers anyway, so this adds little to a run.
+
+    Parameters:
+        filename (str): path to an input file (outliers or ped)
+
+    Returns:
+        (dict): file size and sha256 of the file contents"""
+
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return {'size': os.path.getsize(filename), 'sha256': sha.hexdigest()}
+
+def new_manifest(args):
+    """Start a checkpoint manifest for a fresh run: the parameters and input
+    fingerprints, with no trios completed and an empty output file."""
+
+    return {
+        'params': {param: getattr(args, param) for param in MANIFEST_PARAMS},
+        'inputs': {'outliers': fingerprint(args.outliers),
+                    'ped': fingerprint(args.ped)},
+        'completed': [],
+        'out_size': 0,
+    }
+
+def write_manifest(args, manifest):
+    """Write the manifest atomically, so an interruption never leaves a
+    half-written checkpoint behind."""
+
+    tmp = manifest_path(args) + '.tmp'
+    with open(tmp, 'w') as outfile:
+        json.dump(manifest, outfile, indent = 1)
+    os.replace(tmp, manifest_path(args))
+
+def load_manifest(args):
+    """Read the checkpoint manifest for a --resume run and make sure it was
+    written by a run with the same parameters and inputs. The output file is
+    truncated back to the size recorded after the last completed trio, which
+    drops any rows from a trio that was interrupted part way through.
+
+    Returns:
+        (dict): the manifest, or None if there is nothing to resume from"""
+
+    if not os.path.exists(manifest_path(args)):
+        return None
+    with open(manifest_path(args)) as infile:
+        manifest = json.load(infile)
+
+    expected = new_manifest(args)
+    if manifest['params'] != expected['params']:
+        raise ValueError('cannot resume: parameters differ from the checkpointed run')
+    if manifest['inputs'] != expected['inputs']:
+        raise ValueError('cannot resume: input files changed since the checkpointed run')
+    if not os.path.exists(args.out) or os.path.getsize(args.out) < manifest['out_size']:
+        raise ValueError('cannot resume: output file is missing or shorter than checkpoint')
+
+    with open(args.out, 'r+') as outfile:
+        outfile.truncate(manifest['out_size'])
+
+    return manifest
 
 def get_denovos(args):
     """Tying it all together: here we import the files we need from their arguments,
     and set up the strlingMV function to run on every sample that is the kid of
-    a trio."""
+    a trio.
+
+    Trios are planned up front: any trio with a member missing from the
+    outliers is reported and skipped, and with --shard only this shard's
+    share of the trios is run. With --families, siblings that share parents
+    are run together by family_strlingMV. Each finished trio is recorded in a checkpoint
+    manifest next to --out, so that a --resume run can skip it and keep
+    appending where it left off. Progress is reported every --progress
+    seconds, on stderr or to the --metrics file."""
 
+    params = get_params(args)
+    shard = parse_shard(args.shard) if args.shard is not None else None
+
+    pd = import_pandas()
     df = pd.read_table(args.outliers, delim_whitespace = True,
                         dtype = {'sample' : str}, index_col = False)
-    ped = peddy.Ped(args.ped, 'Paternal_ID' == str, )
-
-    with open(args.out, 'w') as newfile:
-            pass
-    writeHeader = True
-
-    for sample in ped.samples():
-        if has_parents(sample):
-            if sample.mom.phenotype != '0':
-                mutation = sample.mom.phenotype
-            elif sample.dad.phenotype != '0':
-                mutation = sample.dad.phenotype
-            else:
-                mutation = '0'
-                # supply mutation from mom and dad in pedigree
-                #mom will override dad if both are non-zero
-                # this could be a problem...
+    planned, skipped = plan_trios(df, read_trios(args.ped))
+    for trio, missing in skipped:
+        print('Skipping', trio.kid, '- no outlier rows for', ', '.join(missing))
+    # with --families, siblings are grouped by parents and a shard gets whole
+    # families; otherwise every trio is run on its own
+    if args.families:
+        families = group_families(planned)
+    else:
+        families = [([(trio, work)], work) for trio, work in planned]
+    if shard is not None:
+        pedorder = {trio.kid: i for i, (trio, work) in enumerate(planned)}
+        families = shard_trios(families, *shard)
+        planned = sorted((entry for family, work in families for entry in family),
+                        key = lambda entry: pedorder[entry[0].kid])
+    familyof = {trio.kid: family for family, work in families
+                for trio, _ in family}
+
+    manifest = load_manifest(args) if args.resume else None
+    if manifest is None:
+        manifest = new_manifest(args)
+        with open(args.out, 'w') as newfile:
+                pass
+        write_manifest(args, manifest)
+    completed = set(manifest['completed'])
+    writeHeader = len(completed) == 0
+    progress = Progress(planned, args.progress, args.metrics, completed)
+
+    # kids are always written in ped order; with --families a whole family
+    # is classified when its first kid comes up, and held until each kid's turn
+    results = {}
+    for trio, work in planned:
+        if trio.kid in completed:
+            continue
+
+        if args.families:
+            if trio.kid not in results:
+                family = [sibling for sibling, _ in familyof[trio.kid]
+                            if sibling.kid not in completed]
+                results.update(zip([sibling.kid for sibling in family],
+                                family_strlingMV(df, family, args, params)))
+                progress.batch([sibling.kid for sibling in family])
+            kiddadmom, loci = results.pop(trio.kid)
+            rows = write_trio(kiddadmom, trio.kid, loci, args, writeHeader)
+        else:
+            loci, rows = strlingMV(df, trio.kid, trio.mom, trio.dad,
+                            trio.mutation, args, writeHeader, params)
+
+        writeHeader = False #don't want to keep writing header
 
-            strlingMV(df, sample.sample_id, sample.maternal_id,
-                    sample.paternal_id, mutation, args, writeHeader)
+        manifest['completed'].append(trio.kid)
+        manifest['out_size'] = os.path.getsize(args.out)
+        write_manifest(args, manifest)
+        progress.update(work, loci, rows, trio.kid)
 
-            writeHeader = False #don't want to keep writing header
+    progress.finish()
 
 if __name__ == "__main__":
 	main()
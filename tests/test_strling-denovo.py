@@ -1,3 +1,4 @@
+import os
 import sys
 sys.path.append("..")
 from denovo import *
@@ -5,8 +6,8 @@ import pytest
 import argparse
 import numpy as np
 
-args = get_args(['--outliers', 'test.tsv', '--ped', 'test.ped', '--out', 'testout.tsv'])
-# additional args set with default values
+params = get_params(get_args(['--outliers', 'test.tsv', '--ped', 'test.ped', '--out', 'testout.tsv']))
+# additional params set with default values
 
 @pytest.mark.parametrize("allele1, allele2, expected", [
     (100, 100, (100, 100)),  # check to see if allele baseline functions
@@ -21,7 +22,7 @@ args = get_args(['--outliers', 'test.tsv', '--ped', 'test.ped', '--out', 'testou
     # can't figure out how to get NaN to pytest work... code definitely works
 
 def test_allele_check(allele1, allele2, expected):
-    assert allele_check(allele1, allele2, args) == expected
+    assert allele_check(allele1, allele2, params) == expected
 
 @pytest.mark.parametrize("allele, expected", [
     (100, (90, 110.00000000000001)), # check to 0.1 easily, some rounding
@@ -31,11 +32,11 @@ def test_allele_check(allele1, allele2, expected):
     ])
 
 def test_wiggle(allele, expected):
-    assert wiggle(allele, args) == expected
+    assert wiggle(allele, params) == expected
 
 #def test_wiggle_error(allele):
 #    with pytest.raises(ValueError):
-#        wiggle(allele, args)
+#        wiggle(allele, params)
 # No longer relevant here with args change of input
 
 @pytest.mark.parametrize("allele1, allele2, expected", [
@@ -46,7 +47,7 @@ def test_wiggle(allele, expected):
     ])
 
 def test_allele_range(allele1, allele2, expected):
-    assert allele_range(allele1, allele2, args) == expected
+    assert allele_range(allele1, allele2, params) == expected
 
 @pytest.mark.parametrize("allele1, allele2, kidallele, expected", [
     (100, 100, 100, True), # kidallele matching parent allele returns True
@@ -60,7 +61,7 @@ def test_allele_range(allele1, allele2, expected):
     ])
 
 def test_check_range(allele1, allele2, kidallele, expected):
-    assert check_range(allele1, allele2, kidallele, args) == expected
+    assert check_range(allele1, allele2, kidallele, params) == expected
 
 
 @pytest.mark.parametrize("mom_dict, dad_dict, kid_dict, expected", [
@@ -110,4 +111,349 @@ def test_check_range(allele1, allele2, kidallele, expected):
     ])
 
 def test_full_allele_check(mom_dict, dad_dict, kid_dict, expected):
-    assert full_allele_check(mom_dict, dad_dict, kid_dict, args) == expected
+    assert full_allele_check(mom_dict, dad_dict, kid_dict, params) == expected
+
+diffparams = get_params(get_args(['--outliers', 'test.tsv', '--ped', 'test.ped',
+    '--out', 'testout.tsv', '--includeDMV', 'Yes', '--includeallelediff', 'Yes']))
+
+@pytest.mark.parametrize("mom, dad, kid, expected", [
+    ((100, 150), (200, 250), (100, 200), ('Full match', False, 0, 0, 0, 0)),
+    # kid allele 1 from mom, allele 2 from dad
+
+    ((100, 150), (200, 250), (210, 105), ('Full match', False, 10, 5, 0.05, 0.05)),
+    # kid allele 1 from dad, allele 2 from mom
+
+    ((100, np.nan), (200, 200), (100, 200), ('Full match', False, 0, 0, 0, 0)),
+    # nan parent allele is replaced before the differences
+
+    ((20, 20), (20, 20), (20, 300), ('MV', True, 0, 280, 0, 14)),
+    # amplified MV, kid allele 2 closest to mom
+
+    ((20, 20), (30, 30), (200, 400),
+        ('Double MV, likely error', True, 180, 370, 9, 370/30)),
+    # amplified double MV counts with includeDMV, allele 2 closest to dad
+
+    ((20, 20), (30, 30), (60, 70),
+        ('Double MV, likely error', False, 40, 40, 2, 40/30)),
+    # double MV that is not an amplification
+
+    ((20, 20), (30, 30), (np.nan, np.nan),
+        ('Missing alleles, ignore', False, np.nan, np.nan, np.nan, np.nan)),
+    ])
+
+def test_full_allele_check_dmv_allelediff(mom, dad, kid, expected):
+    result = full_allele_check({'allele1': mom[0], 'allele2': mom[1]},
+                            {'allele1': dad[0], 'allele2': dad[1]},
+                            {'allele1': kid[0], 'allele2': kid[1]}, diffparams)
+    assert result[:2] == expected[:2]
+    assert result[2:] == pytest.approx(expected[2:], nan_ok = True)
+
+def test_full_allele_check_dmv_not_included():
+    # the amplified double MV above is not counted without includeDMV
+    assert full_allele_check({'allele1': 20, 'allele2': 20},
+        {'allele1': 30, 'allele2': 30}, {'allele1': 200, 'allele2': 400},
+        params) == ('Double MV, likely error', False)
+
+def test_load_manifest_truncates_partial_trio(tmp_path):
+    outliers = tmp_path / 'outliers.tsv'
+    ped = tmp_path / 'trio.ped'
+    out = tmp_path / 'out.tsv'
+    outliers.write_text('sample\tlocus\n')
+    ped.write_text('K001\tkid\tdad\tmom\t1\t1\n')
+    resumeargs = get_args(['--outliers', str(outliers), '--ped', str(ped),
+                        '--out', str(out), '--resume'])
+    assert load_manifest(resumeargs) is None
+
+    out.write_text('header\nkid1 rows\n')
+    manifest = new_manifest(resumeargs)
+    manifest['completed'] = ['kid1']
+    manifest['out_size'] = out.stat().st_size
+    write_manifest(resumeargs, manifest)
+
+    # rows from an interrupted trio are dropped on resume
+    with open(out, 'a') as outfile:
+        outfile.write('partial kid2 ro')
+    assert load_manifest(resumeargs)['completed'] == ['kid1']
+    assert out.read_text() == 'header\nkid1 rows\n'
+
+    resumeargs.wiggle = 0.5
+    with pytest.raises(ValueError):
+        load_manifest(resumeargs)
+
+@pytest.mark.parametrize("momphenotype, dadphenotype, expected", [
+    ('2', '1', '2'),   # mom overrides dad
+    ('0', '1', '1'),   # dad is used when mom has no phenotype
+    ('0', '0', '0'),
+    ('-9', '2', '-9'), # unknown mom still overrides
+    ])
+
+def test_trio_mutation(momphenotype, dadphenotype, expected):
+    assert trio_mutation(momphenotype, dadphenotype) == expected
+
+def test_read_trios(tmp_path):
+    trioped = os.path.join(os.path.dirname(__file__), '..', 'Trio.ped')
+    assert read_trios(trioped) == [Trio('HG002_NA24385_son.30x',
+        'HG004_NA24143_mother.30x', 'HG003_NA24149_father.30x', '1')]
+
+    ped = tmp_path / 'family.ped'
+    ped.write_text('F1\tk1\td\tm\t1\t1\n'
+                    'F2 k2 d2 0 1 1\n'
+                    'F1\tm\t0\t0\t2\t2\n'
+                    'F1\tk2\td\tm\t2\t1\n')
+    # parents without a row of their own get an unknown phenotype
+    assert read_trios(str(ped)) == [Trio('k1', 'm', 'd', '2'),
+        Trio('k2', 'm', 'd', '2')]
+
+def test_plan_trios():
+    import pandas as pd
+    df = pd.DataFrame({'sample': ['kid', 'kid', 'mom', 'dad', 'dad', 'kid2']})
+    trios = [Trio('kid', 'mom', 'dad', '1'), Trio('kid2', 'mom2', 'dad', '1')]
+    planned, skipped = plan_trios(df, trios)
+    assert planned == [(trios[0], 5)]
+    assert skipped == [(trios[1], ['mom2'])]
+
+def test_shard_trios():
+    planned = [(Trio('k%d' % i, 'm', 'd', '0'), work)
+                for i, work in enumerate([1, 9, 4, 5, 1])]
+    shards = [shard_trios(planned, index, 2) for index in range(2)]
+    # largest first onto the lightest shard, ped order kept within a shard
+    assert [trio.kid for trio, work in shards[0]] == ['k0', 'k1']
+    assert [trio.kid for trio, work in shards[1]] == ['k2', 'k3', 'k4']
+
+@pytest.mark.parametrize("shard", ['0/2', '3/2', '1', 'a/b'])
+
+def test_parse_shard_error(shard):
+    with pytest.raises(ValueError):
+        parse_shard(shard)
+
+def test_get_params():
+    params = get_params(get_args(['--outliers', 'x', '--ped', 'x', '--out', 'x',
+                        '--wiggle', '0.2', '--includeDMV', 'Yes']))
+    assert params.switchover == 50.0 # minwig 10 / wiggle 0.2
+    assert params.includeDMV is True
+    assert params.includeallelediff is False
+    with pytest.raises(AttributeError):
+        params.wiggle = 0.5
+
+@pytest.mark.parametrize("flags", [
+    ['--wiggle', '1.5'],
+    ['--wiggle', '-0.1'],
+    ['--includeDMV', 'yes'],
+    ])
+
+def test_get_params_error(flags):
+    with pytest.raises(ValueError):
+        get_params(get_args(['--outliers', 'x', '--ped', 'x', '--out', 'x'] + flags))
+
+def test_progress_metrics(tmp_path):
+    import json
+    metrics = tmp_path / 'metrics.jsonl'
+    planned = [(Trio('k%d' % i, 'm', 'd', '0'), 10) for i in range(3)]
+    progress = Progress(planned, 1e-9, str(metrics), done = {'k0'})
+    progress.update(10, 8, 5)
+    progress.finish() # already up to date, nothing more to report
+    reports = [json.loads(line) for line in metrics.read_text().splitlines()]
+    assert len(reports) == 1
+    assert reports[0]['trios_done'] == 2
+    assert reports[0]['trios_total'] == 3
+    assert (reports[0]['loci'], reports[0]['rows_written']) == (8, 5)
+
+    # with reports turned off nothing is written
+    Progress(planned, 0, str(tmp_path / 'off.jsonl')).update(10, 8, 5)
+    assert not (tmp_path / 'off.jsonl').exists()
+
+def test_progress_rolling_rate(monkeypatch, capsys):
+    import denovo
+    clock = iter([0.0, 0.0, 10.0, 11.0, 12.0, 12.0])
+    monkeypatch.setattr(denovo.time, 'monotonic', lambda: next(clock))
+    planned = [(Trio('k%d' % i, 'm', 'd', '0'), 10) for i in range(3)]
+    progress = Progress(planned, 0, window = 2)
+    # nothing done yet: no latency or ETA to show
+    progress.report()
+    assert 'trio latency -, ETA -' in capsys.readouterr().err
+    # a slow first trio, then two fast ones that fill the window
+    progress.update(10, 10, 1)
+    progress.update(10, 100, 1)
+    progress.update(10, 100, 1)
+    snapshot = progress.snapshot(12.0)
+    assert snapshot['loci_per_s'] == 100.0
+    assert snapshot['loci_per_s_total'] == 17.5
+
+def test_merge_names():
+    import pandas as pd
+    kid = pd.DataFrame(columns = ['locus', 'a', 'b', 'sample'])
+    dad = pd.DataFrame(columns = ['locus', 'a', 'c', 'repeatlen'])
+    mom = pd.DataFrame(columns = ['locus', 'a', 'c', 'repeatlen'])
+    kidnames, dadnames, momnames = merge_names(list(kid.columns),
+                                    list(dad.columns), list(mom.columns))
+    # renaming up front gives the same columns as merging in trio order
+    merged = kid.merge(dad, on = 'locus').merge(mom, on = 'locus')
+    renamed = kid.rename(columns = kidnames).merge(dad.rename(
+        columns = dadnames).merge(mom.rename(columns = momnames), on = 'locus'),
+        on = 'locus')
+    assert list(renamed.columns) == list(merged.columns)
+
+def test_group_families():
+    planned = [(Trio('k1', 'm', 'd', '1'), 3), (Trio('k2', 'm2', 'd2', '0'), 4),
+                (Trio('k3', 'm', 'd', '1'), 5)]
+    assert group_families(planned) == [([planned[0], planned[2]], 8),
+                                        ([planned[1]], 4)]
+
+def test_family_strlingMV_matches_trios(tmp_path):
+    pd = import_pandas() # as get_denovos does, before calling strlingMV
+    rows = []
+    for sample, alleles in [('mom', (10, 20)), ('dad', (12, 40)),
+                            ('kid1', (10, 40)), ('kid2', (20, 90))]:
+        for locus, unit in [('chr1-100-CAG', 'CAG'), ('chr1-200-AT', 'AT')]:
+            rows.append({'chrom': 'chr1', 'left': 100, 'right': 150,
+                'repeatunit': unit, 'allele1_est': alleles[0],
+                'allele2_est': alleles[1], 'spanning_reads': 1,
+                'spanning_pairs': 1, 'left_clips': 0, 'right_clips': 0,
+                'unplaced_pairs': 0, 'sum_str_counts': 10, 'sum_str_log': 2.3,
+                'depth': 20, 'outlier': 1.5, 'p': 0.1, 'p_adj': 0.2,
+                'sample': sample, 'locus': locus})
+    df = pd.DataFrame(rows)
+    trios = [Trio('kid1', 'mom', 'dad', '1'), Trio('kid2', 'mom', 'dad', '1')]
+
+    trioargs = get_args(['--outliers', 'x', '--ped', 'x',
+                        '--out', str(tmp_path / 'trios.tsv')])
+    for i, trio in enumerate(trios):
+        strlingMV(df, trio.kid, trio.mom, trio.dad, trio.mutation, trioargs,
+                    i == 0)
+
+    familyargs = get_args(['--outliers', 'x', '--ped', 'x',
+                        '--out', str(tmp_path / 'family.tsv')])
+    for i, (kiddadmom, nloci) in enumerate(
+            family_strlingMV(df, trios, familyargs)):
+        assert nloci == 2
+        write_trio(kiddadmom, trios[i].kid, nloci, familyargs, i == 0)
+
+    assert (tmp_path / 'family.tsv').read_text() == (
+            tmp_path / 'trios.tsv').read_text()
+
+def write_cohort(tmp_path):
+    """A small cohort on disk: two families, one with two kids"""
+    import pandas as pd
+    members = {'mom1': (10, 20), 'dad1': (12, 40), 'kid1a': (10, 40),
+                'kid1b': (20, 90), 'mom2': (30, 30), 'dad2': (15, 60),
+                'kid2': (30, 200)}
+    rows = []
+    for sample, alleles in members.items():
+        for i, unit in enumerate(['CAG', 'AT', 'A', 'GGGGCC']):
+            rows.append({'chrom': 'chr1', 'left': 100 * i, 'right': 100 * i + 50,
+                'repeatunit': unit, 'allele1_est': alleles[0] + i,
+                'allele2_est': alleles[1], 'spanning_reads': 1,
+                'spanning_pairs': 1, 'left_clips': 0, 'right_clips': 0,
+                'unplaced_pairs': 0, 'sum_str_counts': 10, 'sum_str_log': 2.3,
+                'depth': 10 + 5 * i, 'outlier': 1.5, 'p': 0.1, 'p_adj': 0.2,
+                'sample': sample, 'locus': 'chr1-%d-%s' % (100 * i, unit)})
+    outliers = tmp_path / 'outliers.tsv'
+    pd.DataFrame(rows).to_csv(outliers, sep='\t', index=False)
+    ped = tmp_path / 'cohort.ped'
+    ped.write_text('F1\tkid1a\tdad1\tmom1\t1\t1\n'
+                    'F1\tkid1b\tdad1\tmom1\t2\t1\n'
+                    'F1\tmom1\t0\t0\t2\t2\n'
+                    'F1\tdad1\t0\t0\t1\t1\n'
+                    'F2\tkid2\tdad2\tmom2\t1\t1\n'
+                    'F2\tmom2\t0\t0\t2\t1\n'
+                    'F2\tdad2\t0\t0\t1\t1\n')
+
+    return str(outliers), str(ped)
+
+@pytest.mark.parametrize("mode", [[], ['--families']])
+
+def test_resume_matches_uninterrupted_run(tmp_path, monkeypatch, mode):
+    import denovo
+    outliers, ped = write_cohort(tmp_path)
+
+    def run(out, extra = []):
+        denovo.get_denovos(get_args(['--outliers', outliers, '--ped', ped,
+                            '--out', str(out), '--progress', '0'] + mode + extra))
+
+    run(tmp_path / 'clean.tsv')
+
+    # interrupt the run part way through writing the second kid
+    write_trio = denovo.write_trio
+    calls = []
+    def interrupted_write(kiddadmom, kid, nloci, args, writeHeader):
+        calls.append(kid)
+        if len(calls) == 2:
+            with open(args.out, 'a') as outfile:
+                outfile.write('partial row')
+            raise KeyboardInterrupt
+        return write_trio(kiddadmom, kid, nloci, args, writeHeader)
+
+    monkeypatch.setattr(denovo, 'write_trio', interrupted_write)
+    with pytest.raises(KeyboardInterrupt):
+        run(tmp_path / 'resumed.tsv')
+    monkeypatch.setattr(denovo, 'write_trio', write_trio)
+    run(tmp_path / 'resumed.tsv', ['--resume'])
+
+    assert (tmp_path / 'resumed.tsv').read_text() == (
+            tmp_path / 'clean.tsv').read_text()
+
+def test_families_keep_ped_order(tmp_path):
+    import denovo
+    outliers, ped = write_cohort(tmp_path)
+    # a half-sibling between two full siblings, all in one ped family
+    with open(ped, 'w') as pedfile:
+        pedfile.write('F1\tkid1a\tdad1\tmom1\t1\t1\n'
+                    'F1\tkid2\tdad2\tmom1\t1\t1\n'
+                    'F1\tkid1b\tdad1\tmom1\t2\t1\n'
+                    'F1\tmom1\t0\t0\t2\t2\n'
+                    'F1\tdad1\t0\t0\t1\t1\n'
+                    'F1\tdad2\t0\t0\t1\t1\n')
+
+    outputs = []
+    for mode in [[], ['--families']]:
+        out = tmp_path / ('out%d.tsv' % len(outputs))
+        denovo.get_denovos(get_args(['--outliers', outliers, '--ped', ped,
+                            '--out', str(out), '--progress', '0'] + mode))
+        outputs.append(out.read_text())
+
+    kids = [line.split('\t')[8] for line in outputs[0].splitlines()[1:]]
+    assert [kid for i, kid in enumerate(kids) if kid not in kids[:i]] == [
+            'kid1a', 'kid2', 'kid1b']
+    assert outputs[1] == outputs[0]
+
+def test_progress_batch_latency(monkeypatch):
+    import denovo
+    clock = iter([0.0, 10.0, 11.0, 12.0])
+    monkeypatch.setattr(denovo.time, 'monotonic', lambda: next(clock))
+    planned = [(Trio('k%d' % i, 'm', 'd', '0'), 10) for i in range(2)]
+    progress = Progress(planned, 0)
+    # a family of two classified together in 10 s, then 1 s to write each
+    progress.batch(['k0', 'k1'])
+    progress.update(10, 4, 2, 'k0')
+    progress.update(10, 4, 2, 'k1')
+    assert list(progress.latencies) == [6.0, 6.0]
+
+@pytest.mark.parametrize("flags", [[], ['--includeallelediff', 'Yes']])
+
+def test_first_kid_without_shared_loci(tmp_path, flags):
+    import pandas as pd
+    outliers, ped = write_cohort(tmp_path)
+    # move the first kid's loci off the parents' loci
+    df = pd.read_table(outliers)
+    df.loc[df['sample'] == 'kid1a', 'locus'] += '-moved'
+    df.to_csv(outliers, sep='\t', index=False)
+
+    outputs = []
+    for mode in ([], ['--families']):
+        out = tmp_path / ('out%d.tsv' % len(mode))
+        get_denovos(get_args(['--outliers', outliers, '--ped', ped,
+                    '--out', str(out), '--progress', '0'] + mode + flags))
+        outputs.append(out.read_text())
+
+    assert outputs[0] == outputs[1]
+    assert 'mendelianstatus\tnovel_amp' in outputs[0].splitlines()[0]
+
+def test_fingerprint_sees_changes_anywhere(tmp_path):
+    data = bytearray(3 * (1 << 20))
+    infile = tmp_path / 'outliers.tsv'
+    infile.write_bytes(bytes(data))
+    before = fingerprint(str(infile))
+    # same size, one byte changed in the middle of the file
+    data[len(data) // 2] = 1
+    infile.write_bytes(bytes(data))
+    assert fingerprint(str(infile)) != before